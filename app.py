@@ -1,29 +1,66 @@
 import os
+import secrets
 from datetime import timedelta
 from flask import Flask
-from config import Config
+from flask_compress import Compress
+from config import settings
 
 def create_app():
     app = Flask(__name__)
 
     # ── Core config ───────────────────────────────────────────
-    app.secret_key = Config.SECRET_KEY
-    app.config["MAX_CONTENT_LENGTH"] = Config.MAX_CONTENT_LENGTH
+    if settings.SECRET_KEY:
+        app.secret_key = settings.SECRET_KEY
+    elif settings.DEBUG:
+        # throwaway dev key: sessions just don't survive a restart
+        app.secret_key = secrets.token_hex(32)
+    else:
+        raise RuntimeError("SECRET_KEY is not set; refusing to sign sessions with a default key.")
+    app.config["MAX_CONTENT_LENGTH"] = settings.MAX_CONTENT_LENGTH
     app.permanent_session_lifetime = timedelta(days=7)
 
+    # ── Server-side sessions (Redis) when configured ──────────
+    if settings.REDIS_URL:
+        from flask_session import Session
+        from db import get_redis
+
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = get_redis()
+        app.config["SESSION_PERMANENT"] = True
+        Session(app)
+
+    # ── Response compression (HTML / JSON) ────────────────────
+    app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+    app.config["COMPRESS_MIN_SIZE"] = 500
+    app.config["COMPRESS_LEVEL"] = 6
+    Compress(app)
+
     # ── Ensure upload directory exists ────────────────────────
-    os.makedirs(Config.UPLOAD_BASE_FOLDER, exist_ok=True)
+    os.makedirs(settings.UPLOAD_BASE_FOLDER, exist_ok=True)
 
     # ── Register blueprints ───────────────────────────────────
-    from auth import auth_bp
+    from auth import auth_bp, limiter
     from routes import main_bp
 
+    limiter.init_app(app)
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
 
+    if settings.FACE_WARMUP:
+        from service import warm_up_face_models
+        warm_up_face_models()
+
+    # ── Maintenance commands ──────────────────────────────────
+    @app.cli.command("normalize-embeddings")
+    def normalize_embeddings_cmd():
+        """Rewrite stored face embeddings as unit vectors (one-shot migration)."""
+        from service import normalize_stored_embeddings
+        print(f"Normalized {normalize_stored_embeddings()} embedding(s).")
+
     return app
 
 
 if __name__ == "__main__":
     app = create_app()
-    app.run(debug=Config.DEBUG, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # Development server only — use gunicorn (see wsgi.py) in production.
+    app.run(debug=settings.DEBUG, host="0.0.0.0", port=5000, threaded=True)
\ No newline at end of file
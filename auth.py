@@ -1,35 +1,109 @@
+import hmac
 import uuid
+import bcrypt
 import secrets
 import hashlib
-import smtplib
+import threading
+from cachetools import TTLCache
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from supabase import create_client
-from config import Config
+from flask import (Blueprint, render_template, request, redirect, url_for, session, flash,
+                   current_app)
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from config import settings
+from db import get_supabase, get_pg_pool, pg_fetch_one
+from mailer import send_email_task
+from auth_cache import prime_user, invalidate_user
 
 auth_bp = Blueprint("auth", __name__)
-supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_SERVICE_KEY)
+
+# Brute-force guard for the credential endpoints; initialised in create_app().
+# Rejected requests never reach Supabase or bcrypt.
+limiter = Limiter(get_remote_address, storage_uri=settings.REDIS_URL or "memory://")
+
+# Compared against when the email is unknown, so every login pays one bcrypt check.
+_DUMMY_HASH = bcrypt.hashpw(secrets.token_bytes(16), bcrypt.gensalt(rounds=12))
+
+# Unused reset-token rows keyed by token_hash; TTL matches link expiry.
+_token_cache = TTLCache(maxsize=1024, ttl=3600)
+_token_lock  = threading.Lock()
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
 
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=12)).decode("ascii")
+
+
+def _is_legacy_hash(stored: str) -> bool:
+    """Accounts created before bcrypt hold a bare 64-char SHA-256 hex digest."""
+    return len(stored) == 64 and not stored.startswith("$2")
+
+
+def verify_password(password: str, stored: str) -> bool:
+    if not stored:
+        return False
+    if _is_legacy_hash(stored):
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), stored.encode("ascii"))
+    except ValueError:
+        return False
+
+
+def _find_login_user(email: str) -> dict | None:
+    if get_pg_pool() is not None:
+        return pg_fetch_one(
+            "SELECT id::text AS id, email, full_name, created_at::text AS created_at, "
+            "password_hash FROM users WHERE email = %s", (email,))
+    res = (
+        get_supabase().table("users")
+        .select("id, email, full_name, created_at, password_hash")
+        .eq("email", email)
+        .maybe_single()
+        .execute()
+    )
+    return res.data if res else None
+
+
+def _login_url() -> str:
+    """External login URL, built on first use and then kept in app.config."""
+    url = current_app.config.get("LOGIN_URL")
+    if url is None:
+        url = current_app.config["LOGIN_URL"] = url_for("auth.auth_page", _external=True)
+    return url
+
+
+def hash_token(token: str) -> str:
+    """Only this digest is stored; the raw reset token lives solely in the emailed link."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _get_reset_token(token_hash: str) -> dict | None:
+    with _token_lock:
+        row = _token_cache.get(token_hash)
+    if row is not None:
+        return row
+    res = (
+        get_supabase().table("reset_tokens")
+        .select("*")
+        .eq("token_hash", token_hash)
+        .eq("used", False)
+        .execute()
+    )
+    row = res.data[0] if res.data else None
+    if not row:
+        return None
+    with _token_lock:
+        _token_cache[token_hash] = row
+    return row
 
 
-def send_email_util(to: str, subject: str, html_body: str):
-    msg = MIMEMultipart("alternative")
-    msg["From"] = Config.GMAIL_EMAIL
-    msg["To"] = to
-    msg["Subject"] = subject
-    msg.attach(MIMEText(html_body, "html"))
-    with smtplib.SMTP(Config.GMAIL_SMTP_HOST, Config.GMAIL_SMTP_PORT) as s:
-        s.ehlo()
-        s.starttls()
-        s.login(Config.GMAIL_EMAIL, Config.GMAIL_APP_PASSWORD)
-        s.sendmail(Config.GMAIL_EMAIL, to, msg.as_string())
+@auth_bp.errorhandler(429)
+def too_many_attempts(e):
+    flash("Too many attempts. Please wait a while and try again.", "error")
+    return redirect(url_for("auth.auth_page", tab="login")), 303
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -46,13 +120,15 @@ def auth_page():
 # ── SIGN UP ───────────────────────────────────────────────────────────────────
 
 @auth_bp.route("/signup", methods=["POST"])
+@limiter.limit(settings.SIGNUP_RATE_LIMIT)
 def signup():
-    full_name = request.form.get("full_name", "").strip()
-    email = request.form.get("email", "").strip().lower()
-    password = request.form.get("password", "")
-    confirm = request.form.get("confirm_password", "")
+    form = request.form
+    full_name = form.get("full_name", "").strip()
+    email = form.get("email", "").strip().lower()
+    password = form.get("password", "")
+    confirm = form.get("confirm_password", "")
 
-    if not all([full_name, email, password, confirm]):
+    if not (full_name and email and password and confirm):
         flash("All fields are required.", "error")
         return redirect(url_for("auth.auth_page", tab="signup"))
 
@@ -66,14 +142,14 @@ def signup():
 
     # check duplicate
     existing = (
-        supabase.table("users").select("id").eq("email", email).execute().data
+        get_supabase().table("users").select("id").eq("email", email).limit(1).execute().data
     )
     if existing:
         flash("An account with this email already exists.", "error")
         return redirect(url_for("auth.auth_page", tab="signup"))
 
     user_id = str(uuid.uuid4())
-    supabase.table("users").insert(
+    get_supabase().table("users").insert(
         {
             "id": user_id,
             "email": email,
@@ -82,28 +158,16 @@ def signup():
         }
     ).execute()
 
-    # welcome email
-    try:
-        send_email_util(
-            to=email,
-            subject="Welcome to Drishyamitra 🎉",
-            html_body=f"""
-            <div style="font-family:Arial,sans-serif;max-width:600px;margin:auto;padding:30px;
-                        background:#f9f9f9;border-radius:12px;">
-              <h1 style="color:#6c63ff;">Welcome to Drishyamitra!</h1>
-              <p>Hi <strong>{full_name}</strong>,</p>
-              <p>Your account has been created successfully.
-                 Start uploading photos and let our AI organize them for you!</p>
-              <a href="{url_for('auth.auth_page', _external=True)}"
-                 style="display:inline-block;padding:12px 24px;background:#6c63ff;
-                        color:white;border-radius:8px;text-decoration:none;margin-top:16px;">
-                Log In Now
-              </a>
-              <p style="margin-top:24px;color:#888;">— The Drishyamitra Team</p>
-            </div>""",
-        )
-    except Exception:
-        pass  # don't block signup if email fails
+    # welcome email (delivered in the background)
+    send_email_task(
+        to=email,
+        subject="Welcome to Drishyamitra 🎉",
+        html_body=render_template(
+            "emails/welcome.html",
+            full_name=full_name,
+            login_url=_login_url(),
+        ),
+    )
 
     flash("Account created! Please log in.", "success")
     return redirect(url_for("auth.auth_page", tab="login"))
@@ -112,37 +176,41 @@ def signup():
 # ── LOGIN ─────────────────────────────────────────────────────────────────────
 
 @auth_bp.route("/login", methods=["POST"])
+@limiter.limit(settings.LOGIN_RATE_LIMIT)
 def login():
-    email = request.form.get("email", "").strip().lower()
-    password = request.form.get("password", "")
+    form = request.form
+    email = form.get("email", "").strip().lower()
+    password = form.get("password", "")
 
     if not email or not password:
         flash("Email and password are required.", "error")
         return redirect(url_for("auth.auth_page", tab="login"))
 
-    res = (
-        supabase.table("users")
-        .select("*")
-        .eq("email", email)
-        .eq("password_hash", hash_password(password))
-        .execute()
-    )
-    user = res.data[0] if res.data else None
-
+    user = _find_login_user(email)
     if not user:
+        # burn the same bcrypt cost so response time doesn't reveal unknown emails
+        bcrypt.checkpw(password.encode("utf-8"), _DUMMY_HASH)
+
+    if not user or not verify_password(password, user["password_hash"]):
         flash("Invalid email or password.", "error")
         return redirect(url_for("auth.auth_page", tab="login"))
 
+    # upgrade legacy SHA-256 hashes to bcrypt on first successful login
+    if _is_legacy_hash(user["password_hash"]):
+        get_supabase().table("users").update(
+            {"password_hash": hash_password(password)}
+        ).eq("id", user["id"]).execute()
+
+    prime_user(user)
     session.permanent = True
-    session["user_id"] = user["id"]
-    session["user_name"] = user["full_name"]
-    session["user_email"] = user["email"]
+    session["user_id"] = user["id"]  # name/email come from auth_cache
     return redirect(url_for("main.dashboard"))
 
 
 # ── FORGOT PASSWORD ───────────────────────────────────────────────────────────
 
 @auth_bp.route("/forgot-password", methods=["GET", "POST"])
+@limiter.limit(settings.FORGOT_PASSWORD_RATE_LIMIT, methods=["POST"])
 def forgot_password():
     if request.method == "GET":
         return render_template("auth.html", tab="forgot")
@@ -152,7 +220,7 @@ def forgot_password():
         flash("Please enter your email address.", "error")
         return redirect(url_for("auth.forgot_password"))
 
-    user_res = supabase.table("users").select("id, full_name").eq("email", email).execute()
+    user_res = get_supabase().table("users").select("id, full_name").eq("email", email).execute()
     if not user_res.data:
         # Don't reveal whether email exists
         flash("If that email is registered, a reset link has been sent.", "info")
@@ -162,40 +230,22 @@ def forgot_password():
     token = secrets.token_urlsafe(32)
     expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat()
 
-    supabase.table("reset_tokens").insert(
+    get_supabase().table("reset_tokens").insert(
         {
             "user_id": user["id"],
-            "token": token,
+            "token_hash": hash_token(token),
             "expires_at": expires_at,
         }
     ).execute()
 
     reset_link = url_for("auth.reset_password", token=token, _external=True)
-    try:
-        send_email_util(
-            to=email,
-            subject="Drishyamitra – Password Reset Request",
-            html_body=f"""
-            <div style="font-family:Arial,sans-serif;max-width:600px;margin:auto;padding:30px;
-                        background:#f9f9f9;border-radius:12px;">
-              <h2 style="color:#6c63ff;">Password Reset Request</h2>
-              <p>Hi <strong>{user['full_name']}</strong>,</p>
-              <p>Click the button below to reset your password.
-                 This link expires in <strong>1 hour</strong>.</p>
-              <a href="{reset_link}"
-                 style="display:inline-block;padding:12px 24px;background:#e74c3c;
-                        color:white;border-radius:8px;text-decoration:none;margin-top:16px;">
-                Reset Password
-              </a>
-              <p style="margin-top:16px;color:#888;font-size:13px;">
-                If you didn't request this, please ignore this email.
-              </p>
-              <p style="color:#888;">— The Drishyamitra Team</p>
-            </div>""",
-        )
-    except Exception as e:
-        flash("Could not send reset email. Check server email config.", "error")
-        return redirect(url_for("auth.forgot_password"))
+    send_email_task(
+        to=email,
+        subject="Drishyamitra – Password Reset Request",
+        html_body=render_template(
+            "emails/reset.html", full_name=user["full_name"], reset_link=reset_link
+        ),
+    )
 
     flash("If that email is registered, a reset link has been sent.", "info")
     return redirect(url_for("auth.auth_page", tab="login"))
@@ -204,14 +254,8 @@ def forgot_password():
 @auth_bp.route("/reset-password/<token>", methods=["GET", "POST"])
 def reset_password(token: str):
     # Validate token
-    res = (
-        supabase.table("reset_tokens")
-        .select("*")
-        .eq("token", token)
-        .eq("used", False)
-        .execute()
-    )
-    token_row = res.data[0] if res.data else None
+    token_hash = hash_token(token)
+    token_row  = _get_reset_token(token_hash)
 
     if not token_row:
         flash("Invalid or expired reset link.", "error")
@@ -226,8 +270,9 @@ def reset_password(token: str):
     if request.method == "GET":
         return render_template("auth.html", tab="reset", token=token)
 
-    new_password = request.form.get("password", "")
-    confirm = request.form.get("confirm_password", "")
+    form = request.form
+    new_password = form.get("password", "")
+    confirm = form.get("confirm_password", "")
 
     if not new_password or len(new_password) < 6:
         flash("Password must be at least 6 characters.", "error")
@@ -237,13 +282,18 @@ def reset_password(token: str):
         flash("Passwords do not match.", "error")
         return redirect(url_for("auth.reset_password", token=token))
 
-    # update password
-    supabase.table("users").update(
-        {"password_hash": hash_password(new_password)}
-    ).eq("id", token_row["user_id"]).execute()
+    # update password + mark token used in one transaction (see README for the SQL)
+    res = get_supabase().rpc(
+        "reset_user_password",
+        {"p_token_hash": token_hash, "p_hash": hash_password(new_password)},
+    ).execute()
+    with _token_lock:
+        _token_cache.pop(token_hash, None)
+    invalidate_user(token_row["user_id"])
 
-    # mark token used
-    supabase.table("reset_tokens").update({"used": True}).eq("token", token).execute()
+    if not res.data:
+        flash("Invalid or expired reset link.", "error")
+        return redirect(url_for("auth.auth_page", tab="login"))
 
     flash("Password updated successfully. Please log in.", "success")
     return redirect(url_for("auth.auth_page", tab="login"))
@@ -253,6 +303,7 @@ def reset_password(token: str):
 
 @auth_bp.route("/logout")
 def logout():
+    invalidate_user(session.get("user_id"))
     session.clear()
     flash("You have been logged out.", "info")
     return redirect(url_for("auth.auth_page", tab="login"))
\ No newline at end of file
@@ -0,0 +1,41 @@
+import threading
+from cachetools import TTLCache
+from db import get_supabase, get_pg_pool, pg_fetch_one
+
+# Short-lived, per-process cache of user rows keyed by user_id.
+# Only public profile fields are kept — never the password hash.
+USER_FIELDS = ("id", "email", "full_name", "created_at")
+
+_cache = TTLCache(maxsize=10000, ttl=60)
+_lock  = threading.Lock()
+
+
+def get_user(user_id: str) -> dict | None:
+    """Return the user row for ``user_id``, hitting Supabase only on a cache miss."""
+    with _lock:
+        user = _cache.get(user_id)
+    if user is not None:
+        return user
+    if get_pg_pool() is not None:
+        row = pg_fetch_one(
+            "SELECT id::text AS id, email, full_name, created_at::text AS created_at "
+            "FROM users WHERE id = %s", (user_id,))
+    else:
+        res = get_supabase().table("users").select(",".join(USER_FIELDS)).eq("id", user_id).execute()
+        row = res.data[0] if res.data else None
+    return prime_user(row) if row else None
+
+
+def prime_user(row: dict) -> dict:
+    """Store a freshly fetched user row so the next lookup is served from memory."""
+    user = {k: row.get(k) for k in USER_FIELDS}
+    with _lock:
+        _cache[user["id"]] = user
+    return user
+
+
+def invalidate_user(user_id: str | None):
+    if not user_id:
+        return
+    with _lock:
+        _cache.pop(user_id, None)
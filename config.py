@@ -1,23 +1,44 @@
 import os
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+# Secrets come from the environment (or a local, untracked .env file) and are
+# read once at import; the rest of the app uses the frozen `settings` instance.
+load_dotenv()
+
+
+def _env(name: str, default: str = "") -> str:
+    return os.environ.get(name, default)
+
+
+@dataclass(frozen=True, slots=True)
 class Config:
-    SECRET_KEY = "drishyamitra-secret-key-change-in-production-2024"
-    DEBUG = True
-    MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50 MB max upload
-    SUPABASE_URL =""
-    SUPABASE_KEY =""         # anon/public key
-    SUPABASE_SERVICE_KEY = ""  # service role key
-    GROQ_API_KEY = ""
-    GROQ_MODEL = "llama-3.3-70b-versatile"
-    GMAIL_EMAIL = ""
-    GMAIL_APP_PASSWORD = ""   # Gmail App Password
-    GMAIL_SMTP_HOST = ""
-    GMAIL_SMTP_PORT = 587
-    UPLOAD_BASE_FOLDER = os.path.join(os.path.dirname(__file__), "static", "uploads")
-    ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "webp", "gif"}
-    DEEPFACE_MODEL = "Facenet512"
-    DEEPFACE_DETECTOR = "retinaface"
-    DEEPFACE_DISTANCE_THRESHOLD = 0.40  
-    TEAM = [
+    SECRET_KEY: str = _env("SECRET_KEY")  # required unless FLASK_DEBUG=1
+    DEBUG: bool = _env("FLASK_DEBUG", "0") == "1"
+    MAX_CONTENT_LENGTH: int = 50 * 1024 * 1024  # 50 MB max upload
+    SUPABASE_URL: str = _env("SUPABASE_URL")
+    SUPABASE_KEY: str = _env("SUPABASE_KEY")                  # anon/public key
+    SUPABASE_SERVICE_KEY: str = _env("SUPABASE_SERVICE_KEY")  # service role key
+    DATABASE_URL: str = _env("DATABASE_URL")  # optional direct Postgres URI for auth lookups
+    GROQ_API_KEY: str = _env("GROQ_API_KEY")
+    GROQ_MODEL: str = "llama-3.3-70b-versatile"
+    GMAIL_EMAIL: str = _env("GMAIL_EMAIL")
+    GMAIL_APP_PASSWORD: str = _env("GMAIL_APP_PASSWORD")      # Gmail App Password
+    GMAIL_SMTP_HOST: str = _env("GMAIL_SMTP_HOST", "smtp.gmail.com")
+    GMAIL_SMTP_PORT: int = int(_env("GMAIL_SMTP_PORT", "587"))
+    REDIS_URL: str = _env("REDIS_URL")  # e.g. redis://localhost:6379/0 — sessions + rate-limit storage
+    LOGIN_RATE_LIMIT: str = "5/minute;20/hour"
+    SIGNUP_RATE_LIMIT: str = "3/hour"
+    FORGOT_PASSWORD_RATE_LIMIT: str = "3/hour"
+    UPLOAD_BASE_FOLDER: str = os.path.join(os.path.dirname(__file__), "static", "uploads")
+    ALLOWED_EXTENSIONS: frozenset = frozenset({"png", "jpg", "jpeg", "webp", "gif"})
+    DEEPFACE_MODEL: str = "Facenet512"
+    DEEPFACE_DETECTOR: str = "retinaface"
+    DEEPFACE_DISTANCE_THRESHOLD: float = 0.40
+    FACE_USE_GPU: bool = _env("FACE_USE_GPU", "0") == "1"  # TensorFlow GPU with on-demand memory growth
+    FACE_FP16: bool = _env("FACE_FP16", "0") == "1"        # mixed_float16 inference (GPU only)
+    FACE_WARMUP: bool = _env("FACE_WARMUP", "0") == "1"    # load face models at startup, not on first upload
+    TEAM: tuple = (
         {
             "name": "V. BARADWAJA",
             "role": "Team Lead & AI Engineer",
@@ -45,9 +66,12 @@ class Config:
             "avatar": "MV",
             "bio": "Crafted the complete UI/UX design, landing page, and responsive templates for the entire application.",
             "skills": ["HTML/CSS", "JavaScript", "UI Design", "Jinja2"]
-        }
-    ]
-    PROJECT_NAME = "Drishyamitra"
-    PROJECT_TAGLINE = "AI-Powered Photo Management System"
-    PROJECT_VERSION = "1.0.0"
-    PROJECT_YEAR = "2024"
\ No newline at end of file
+        },
+    )
+    PROJECT_NAME: str = "Drishyamitra"
+    PROJECT_TAGLINE: str = "AI-Powered Photo Management System"
+    PROJECT_VERSION: str = "1.0.0"
+    PROJECT_YEAR: str = "2024"
+
+
+settings = Config()
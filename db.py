@@ -0,0 +1,44 @@
+from functools import lru_cache
+from supabase import Client, create_client
+from config import settings
+
+
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """Shared Supabase client, created on first use rather than at import.
+
+    Its PostgREST client holds one persistent httpx session, so table/rpc
+    calls already reuse keep-alive connections for the life of the process.
+    """
+    return create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_KEY)
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """Shared Redis client, or None when REDIS_URL is not configured."""
+    if not settings.REDIS_URL:
+        return None
+    import redis
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+@lru_cache(maxsize=1)
+def get_pg_pool():
+    """Direct Postgres connection pool, or None when DATABASE_URL is not configured.
+
+    Used for the per-request auth lookups, which skip the PostgREST HTTP hop;
+    everything else keeps going through the Supabase client.
+    """
+    if not settings.DATABASE_URL:
+        return None
+    from psycopg.rows import dict_row
+    from psycopg_pool import ConnectionPool
+    return ConnectionPool(
+        conninfo=settings.DATABASE_URL, min_size=4, max_size=20, open=True,
+        kwargs={"prepare_threshold": 0, "row_factory": dict_row},
+    )
+
+
+def pg_fetch_one(sql: str, params: tuple) -> dict | None:
+    with get_pg_pool().connection() as conn:
+        return conn.execute(sql, params).fetchone()
@@ -0,0 +1,107 @@
+import smtplib
+import logging
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST, SMTP_PORT = settings.GMAIL_SMTP_HOST, settings.GMAIL_SMTP_PORT
+SMTP_USER, SMTP_PWD  = settings.GMAIL_EMAIL, settings.GMAIL_APP_PASSWORD
+
+# Outgoing mail is handed to a small background pool so request handlers
+# return as soon as the message is queued instead of waiting on SMTP.
+_mail_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mail")
+
+# One authenticated SMTP session per process, reused across sends so only
+# MAIL FROM / RCPT / DATA hit the network. Guarded by _smtp_lock.
+_smtp: smtplib.SMTP | None = None
+_smtp_lock = threading.Lock()
+
+
+def _connect() -> smtplib.SMTP:
+    s = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    s.ehlo()
+    s.starttls()
+    s.login(SMTP_USER, SMTP_PWD)
+    return s
+
+
+def _close(s: smtplib.SMTP):
+    try:
+        s.quit()
+    except Exception:
+        s.close()
+
+
+def _get_smtp() -> smtplib.SMTP:
+    """Return the live pooled connection, reconnecting if the server dropped it.
+
+    Caller must hold ``_smtp_lock``.
+    """
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except OSError:  # includes SMTPServerDisconnected
+            pass
+        _close(_smtp)
+        _smtp = None
+    _smtp = _connect()
+    return _smtp
+
+
+def send_raw(to: str, message: str):
+    """Send an already-built message over the pooled SMTP connection."""
+    global _smtp
+    with _smtp_lock:
+        try:
+            _get_smtp().sendmail(SMTP_USER, to, message)
+        except smtplib.SMTPServerDisconnected:
+            _smtp = None
+            _get_smtp().sendmail(SMTP_USER, to, message)
+
+
+def send_email_util(to: str, subject: str, html_body: str):
+    msg = MIMEMultipart("alternative")
+    msg["From"] = SMTP_USER
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.attach(MIMEText(html_body, "html"))
+    send_raw(to, msg.as_string())
+
+
+def _deliver(to: str, subject: str, html_body: str):
+    try:
+        send_email_util(to, subject, html_body)
+    except Exception as e:
+        logger.error(f"Email to {to} failed: {e}")
+
+
+def send_email_task(to: str, subject: str, html_body: str):
+    """Queue an email for background delivery. Failures are logged by the worker."""
+    return _mail_pool.submit(_deliver, to, subject, html_body)
+
+
+def _deliver_message(to: str, msg: Message, on_result: Callable[[str], None] | None):
+    error = ""
+    try:
+        send_raw(to, msg.as_string())
+    except Exception as e:
+        error = str(e)
+        logger.error(f"Email to {to} failed: {error}")
+    if on_result is not None:
+        try:
+            on_result(error)
+        except Exception as e:
+            logger.error(f"Email callback for {to} failed: {e}")
+
+
+def send_message_task(to: str, msg: Message, on_result: Callable[[str], None] | None = None):
+    """Queue a prebuilt message; ``on_result`` gets "" on success or the error text."""
+    return _mail_pool.submit(_deliver_message, to, msg, on_result)
@@ -1,12 +1,16 @@
 import os
 import uuid
+import hashlib
+import orjson
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from flask import (Blueprint, render_template, request, redirect,
-                   url_for, session, flash, jsonify)
+                   url_for, session, flash, current_app)
 from werkzeug.utils import secure_filename
-from config import Config
+from config import settings
+from auth_cache import get_user
 from service import (
-    allowed_file, process_uploaded_image,
+    allowed_file, enqueue_uploads, upload_status,
     get_all_persons, get_person_photos, rename_person,
     create_folder, delete_folder, delete_photo_from_folder, move_photo_to_folder,
     send_photos_by_email, get_delivery_history, get_dashboard_stats,
@@ -15,6 +19,9 @@ from service import (
 
 main_bp = Blueprint("main", __name__)
 
+UPLOAD_CHUNK   = 1 << 20  # 1 MiB
+UPLOAD_WORKERS = 4
+
 
 def login_required(f):
     @wraps(f)
@@ -26,11 +33,57 @@ def login_required(f):
     return wrapper
 
 
+def current_user_name() -> str | None:
+    user = get_user(session["user_id"])
+    return user["full_name"] if user else None
+
+
+def ojsonify(obj, status: int = 200):
+    """jsonify() replacement serialising with orjson."""
+    return current_app.response_class(orjson.dumps(obj), status=status,
+                                      mimetype="application/json")
+
+
+# Flask-Compress tags the ETag of a compressed body as "<etag>:<algorithm>",
+# and browsers echo that back in If-None-Match.
+_ENCODING_SUFFIXES = (":gzip", ":br", ":deflate")
+
+
+def _strip_encoding(tag: str) -> str:
+    for suffix in _ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def cacheable_json(obj):
+    """JSON response with an ETag so repeat polls get 304 Not Modified."""
+    resp = ojsonify(obj)
+    etag = hashlib.md5(resp.get_data(), usedforsecurity=False).hexdigest()
+    client_tags = request.if_none_match.as_set(include_weak=True)
+    if etag in {_strip_encoding(t) for t in client_tags}:
+        resp = current_app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.cache_control.max_age = 10
+    resp.cache_control.private = True
+    return resp
+
+
+def save_upload(file, dest: str) -> str:
+    """Stream an uploaded file to ``dest`` in one pass, returning its BLAKE2b digest."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(dest, "wb", buffering=UPLOAD_CHUNK) as out:
+        while chunk := file.stream.read(UPLOAD_CHUNK):
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+
 # ── Landing ───────────────────────────────────────────────────────────────────
 
 @main_bp.route("/")
 def landing():
-    return render_template("landing.html", team=Config.TEAM, config=Config)
+    return render_template("landing.html", team=settings.TEAM, config=settings)
 
 
 # ── Dashboard ─────────────────────────────────────────────────────────────────
@@ -42,7 +95,7 @@ def dashboard():
     return render_template("dashboard.html",
                            stats=get_dashboard_stats(uid),
                            persons=get_all_persons(uid),
-                           user_name=session.get("user_name"))
+                           user_name=current_user_name())
 
 
 # ── Upload ────────────────────────────────────────────────────────────────────
@@ -51,27 +104,51 @@ def dashboard():
 @login_required
 def upload_photo():
     uid   = session["user_id"]
-    files = request.files.getlist("photos")
-    count, faces = 0, 0
-    for file in files:
+    files = []
+    for file in request.files.getlist("photos"):
         if not file or not file.filename:
             continue
         if not allowed_file(file.filename):
             flash(f"Skipped: {file.filename}", "warning")
             continue
-        safe = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
-        temp = os.path.join(get_user_upload_root(uid), safe)
-        file.save(temp)
-        r = process_uploaded_image(uid, temp, safe)
-        count += 1; faces += r["faces_detected"]
+        files.append(file)
+
+    # Stream/hash the files to disk in parallel, then queue the burst for
+    # background face recognition; the response doesn't wait for DeepFace.
+    uploads = []
+    if files:
+        with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(files))) as pool:
+            uploads = list(pool.map(lambda f: _save_one(uid, f), files))
+    results = enqueue_uploads(uid, uploads)
+
+    dupes = sum(1 for r in results if r.get("duplicate"))
+    count = len(results) - dupes
 
     if count:
-        flash(f"✅ Uploaded {count} photo(s) · {faces} face(s) detected.", "success")
-    else:
+        flash(f"✅ Uploaded {count} photo(s) · sorting faces into folders in the background.", "success")
+    if dupes:
+        flash(f"Skipped {dupes} photo(s) already in your library.", "info")
+    elif not count:
         flash("No valid files uploaded.", "error")
     return redirect(url_for("main.dashboard"))
 
 
+@main_bp.route("/upload/status/<photo_id>")
+@login_required
+def upload_status_route(photo_id: str):
+    status = upload_status(session["user_id"], photo_id)
+    if status is None:
+        return ojsonify({"photo_id": photo_id, "status": "unknown"}, 404)
+    return ojsonify(status)
+
+
+def _save_one(uid: str, file) -> tuple[str, str, str]:
+    safe   = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    temp   = os.path.join(get_user_upload_root(uid), safe)
+    digest = save_upload(file, temp)
+    return temp, safe, digest
+
+
 # ── Persons / Folders ─────────────────────────────────────────────────────────
 
 @main_bp.route("/persons")
@@ -82,7 +159,7 @@ def persons_page():
                            view="persons",
                            persons=get_all_persons(uid),
                            stats=get_dashboard_stats(uid),
-                           user_name=session.get("user_name"))
+                           user_name=current_user_name())
 
 
 @main_bp.route("/person/<person_id>/photos")
@@ -98,7 +175,7 @@ def person_photos(person_id: str):
                            photos=photos,
                            persons=persons,
                            stats=get_dashboard_stats(uid),
-                           user_name=session.get("user_name"))
+                           user_name=current_user_name())
 
 
 @main_bp.route("/person/<person_id>/rename", methods=["POST"])
@@ -154,9 +231,10 @@ def delete_photo_route(person_id: str):
 @login_required
 def move_photo_route(person_id: str):
     uid       = session["user_id"]
-    filename  = request.form.get("filename", "").strip()
-    dest_id   = request.form.get("dest_person_id", "").strip()
-    keep      = request.form.get("keep_copy") == "1"
+    form      = request.form
+    filename  = form.get("filename", "").strip()
+    dest_id   = form.get("dest_person_id", "").strip()
+    keep      = form.get("keep_copy") == "1"
     if filename and dest_id:
         if move_photo_to_folder(uid, person_id, dest_id, filename, keep_in_source=keep):
             flash("Photo moved.", "success")
@@ -171,15 +249,17 @@ def move_photo_route(person_id: str):
 @login_required
 def send_email_route():
     uid       = session["user_id"]
-    person_id = request.form.get("person_id")
-    recipient = request.form.get("recipient_email", "").strip()
-    msg       = request.form.get("message", "").strip()
+    form      = request.form
+    person_id = form.get("person_id")
+    recipient = form.get("recipient_email", "").strip()
+    msg       = form.get("message", "").strip()
     if not person_id or not recipient:
         flash("Person and recipient email required.", "error")
         return redirect(request.referrer or url_for("main.dashboard"))
     r = send_photos_by_email(uid, person_id, recipient, msg)
     if r["success"]:
-        flash(f"✅ Sent {r['photos_sent']} photo(s) to {recipient}!", "success")
+        flash(f"📤 Sending {r['photos_sent']} photo(s) to {recipient}. "
+              "Check History for delivery status.", "success")
     else:
         flash(f"❌ Failed: {r.get('error')}", "error")
     return redirect(request.referrer or url_for("main.history"))
@@ -194,7 +274,7 @@ def history():
     return render_template("history.html",
                            deliveries=get_delivery_history(uid),
                            persons=get_all_persons(uid),
-                           user_name=session.get("user_name"))
+                           user_name=current_user_name())
 
 
 # ── AI Chat API ───────────────────────────────────────────────────────────────
@@ -206,17 +286,17 @@ def api_chat():
     data = request.get_json(force=True)
     msg  = data.get("message", "").strip()
     if not msg:
-        return jsonify({"error": "empty"}), 400
-    return jsonify(chat_with_assistant(uid, msg, data.get("history", [])))
+        return ojsonify({"error": "empty"}, 400)
+    return ojsonify(chat_with_assistant(uid, msg, data.get("history", [])))
 
 
 @main_bp.route("/api/persons")
 @login_required
 def api_persons():
-    return jsonify(get_all_persons(session["user_id"]))
+    return cacheable_json(get_all_persons(session["user_id"]))
 
 
 @main_bp.route("/api/person/<person_id>/photos")
 @login_required
 def api_person_photos(person_id: str):
-    return jsonify(get_person_photos(person_id, session["user_id"]))
\ No newline at end of file
+    return cacheable_json(get_person_photos(person_id, session["user_id"]))
\ No newline at end of file
@@ -1,28 +1,49 @@
+import io
 import os
 import re
 import uuid
 import json
 import base64
 import shutil
-import smtplib
+import time
+import heapq
 import logging
+import threading
 import numpy as np
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from httpx import TransportError
+from postgrest.exceptions import APIError
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from supabase import create_client
-from groq import Groq
-from deepface import DeepFace
-from config import Config
+from config import settings
+from db import get_supabase, get_redis
+from mailer import send_message_task
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-supabase    = create_client(Config.SUPABASE_URL, Config.SUPABASE_SERVICE_KEY)
-groq_client = Groq(api_key=Config.GROQ_API_KEY)
+_SLUG_STRIP = re.compile(r"[^\w\s-]")
+_SLUG_SEP   = re.compile(r"[\s_-]+")
+_NONWORD    = re.compile(r"[^\w]")
 
-IMAGE_EXTS = tuple(Config.ALLOWED_EXTENSIONS)
+_MIME_MAP = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png",
+             "webp": "image/webp", "gif": "image/gif"}
+
+# Per-process cache of read-mostly per-user query results (persons list,
+# dashboard stats). Every mutation below invalidates it; the TTL only bounds
+# staleness across gunicorn workers.
+_results      = TTLCache(maxsize=4096, ttl=30)
+_results_lock = threading.Lock()
+
+# Per-user face-matching matrix: (unit-normalised float32 (N, D) embeddings,
+# matching person rows). Rebuilt after person create / rename / delete; the
+# TTL bounds staleness when another gunicorn worker changed the persons.
+_person_matrices     = TTLCache(maxsize=256, ttl=30)
+_person_matrices_lock = threading.Lock()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Disk layout:  UPLOAD_BASE_FOLDER / user_id / folder_name / filename.ext
@@ -35,26 +56,92 @@ IMAGE_EXTS = tuple(Config.ALLOWED_EXTENSIONS)
 # HELPERS
 # ══════════════════════════════════════════════════════════════════════════════
 
-def allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+@lru_cache(maxsize=1)
+def get_groq():
+    from groq import Groq
+    return Groq(api_key=settings.GROQ_API_KEY)
+
+
+@lru_cache(maxsize=1)
+def _deepface():
+    # DeepFace pulls in TensorFlow (~2 s); import it only when a photo is processed.
+    if settings.FACE_USE_GPU:
+        os.environ.setdefault("TF_FORCE_GPU_ALLOW_GROWTH", "true")
+    from deepface import DeepFace
+    if settings.FACE_USE_GPU and settings.FACE_FP16:
+        # Must be set before the first build_model(); layers pick up the policy on creation.
+        import tensorflow as tf
+        tf.keras.mixed_precision.set_global_policy("mixed_float16")
+    return DeepFace
+
+
+_models_lock  = threading.Lock()
+_models_ready = False
+
+
+def _load_face_models():
+    """Build the recognition and detector models once per process.
 
+    DeepFace fills its model cache without a lock, so concurrent first calls
+    from the embedding threads would each load the weights.
+    """
+    global _models_ready
+    if not _models_ready:
+        with _models_lock:
+            if not _models_ready:
+                DeepFace = _deepface()
+                DeepFace.build_model(settings.DEEPFACE_MODEL)
+                DeepFace.build_model(settings.DEEPFACE_DETECTOR, task="face_detector")
+                _models_ready = True
+    return _deepface()
 
-def cosine_similarity(a: list, b: list) -> float:
-    a, b = np.array(a, dtype=float), np.array(b, dtype=float)
-    d = np.linalg.norm(a) * np.linalg.norm(b)
-    return float(np.dot(a, b) / d) if d else 0.0
+
+def _warm_up_face_models():
+    try:
+        DeepFace = _load_face_models()
+        # One forward pass so graph tracing / cuDNN autotuning happen now, not on a user's upload.
+        DeepFace.represent(img_path=np.zeros((160, 160, 3), dtype=np.uint8),
+                           model_name=settings.DEEPFACE_MODEL,
+                           detector_backend="skip", enforce_detection=False)
+        logger.info("Face models loaded")
+    except Exception as e:
+        logger.warning(f"Face model warm-up failed: {e}")
+
+
+def warm_up_face_models():
+    """Load the recognition and detection models in the background at startup."""
+    return _upload_pool.submit(_warm_up_face_models)
+
+
+def allowed_file(filename: str) -> bool:
+    _, dot, ext = filename.rpartition(".")
+    return bool(dot) and ext.lower() in settings.ALLOWED_EXTENSIONS
 
 
 def slugify(text: str) -> str:
-    text = re.sub(r"[^\w\s-]", "", text.lower().strip())
-    return re.sub(r"[\s_-]+", "_", text)[:40].strip("_") or "folder"
+    text = _SLUG_STRIP.sub("", text.lower().strip())
+    return _SLUG_SEP.sub("_", text)[:40].strip("_") or "folder"
+
+
+# Directories this process has already created, so the hot path skips the
+# makedirs stat/mkdir pair. Entries are dropped when a folder is removed.
+_KNOWN_DIRS: set[str] = set()
+
+
+def _ensure_dir(p: str) -> str:
+    if p not in _KNOWN_DIRS:
+        os.makedirs(p, exist_ok=True)
+        _KNOWN_DIRS.add(p)
+    return p
+
+
+def _forget_dir(p: str):
+    _KNOWN_DIRS.discard(p)
 
 
 def user_root(user_id: str) -> str:
     """Absolute disk path for a user's upload root. Created automatically."""
-    p = os.path.join(Config.UPLOAD_BASE_FOLDER, user_id)
-    os.makedirs(p, exist_ok=True)
-    return p
+    return _ensure_dir(os.path.join(settings.UPLOAD_BASE_FOLDER, user_id))
 
 
 # Alias so routes.py can import it
@@ -63,9 +150,7 @@ get_user_upload_root = user_root
 
 def folder_disk(user_id: str, folder_name: str) -> str:
     """Absolute disk path for a person/folder. Created automatically."""
-    p = os.path.join(user_root(user_id), folder_name)
-    os.makedirs(p, exist_ok=True)
-    return p
+    return _ensure_dir(os.path.join(user_root(user_id), folder_name))
 
 
 def make_url(user_id: str, folder_name: str, filename: str) -> str:
@@ -73,10 +158,51 @@ def make_url(user_id: str, folder_name: str, filename: str) -> str:
     return f"/static/uploads/{user_id}/{folder_name}/{filename}"
 
 
+def cached(key):
+    """Cache ``fn(user_id)`` in ``_results`` under ``key(user_id)``."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(user_id: str):
+            k = key(user_id)
+            with _results_lock:
+                hit = _results.get(k)
+            if hit is not None:
+                return hit
+            value = fn(user_id)
+            with _results_lock:
+                _results[k] = value
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidate_user_cache(user_id: str):
+    with _results_lock:
+        _results.pop(f"persons:{user_id}", None)
+        _results.pop(f"stats:{user_id}", None)
+
+
 def list_images(folder_path: str) -> list[str]:
     """Sorted list of image filenames inside a disk folder."""
     try:
-        return sorted(f for f in os.listdir(folder_path) if f.lower().endswith(IMAGE_EXTS))
+        with os.scandir(folder_path) as it:
+            names = [e.name for e in it if allowed_file(e.name)]
+    except FileNotFoundError:
+        return []
+    names.sort()
+    return names
+
+
+def _scan_images(folder_path: str) -> list[tuple[str, float]]:
+    """(filename, mtime) for every image in a disk folder.
+
+    One readdir pass; ``is_file()`` usually comes free from the dirent type, but
+    ``DirEntry.stat()`` still costs one stat per image on POSIX.
+    """
+    try:
+        with os.scandir(folder_path) as it:
+            return [(e.name, e.stat().st_mtime) for e in it
+                    if allowed_file(e.name) and e.is_file()]
     except FileNotFoundError:
         return []
 
@@ -85,20 +211,25 @@ def list_images(folder_path: str) -> list[str]:
 # GROQ VISION FALLBACK
 # ══════════════════════════════════════════════════════════════════════════════
 
+B64_CHUNK = 57 * 1024   # multiple of 3, so no padding is emitted mid-stream
+
+
 def _to_b64(path: str) -> str:
+    """Base64-encode a file chunk by chunk so the raw image is never held whole in memory."""
+    buf = io.BytesIO()
     with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+        while chunk := f.read(B64_CHUNK):
+            buf.write(base64.b64encode(chunk))
+    return buf.getvalue().decode("ascii")
 
 
 def _mime(filename: str) -> str:
-    ext = filename.rsplit(".", 1)[-1].lower()
-    return {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png",
-            "webp": "image/webp", "gif": "image/gif"}.get(ext, "image/jpeg")
+    return _MIME_MAP.get(filename.rpartition(".")[2].lower(), "image/jpeg")
 
 
 def groq_describe_for_folder(image_path: str) -> str:
     try:
-        resp = groq_client.chat.completions.create(
+        resp = get_groq().chat.completions.create(
             model="meta-llama/llama-4-scout-17b-16e-instruct",
             messages=[{"role": "user", "content": [
                 {"type": "image_url",
@@ -111,7 +242,7 @@ def groq_describe_for_folder(image_path: str) -> str:
             max_tokens=15, temperature=0.2,
         )
         raw  = resp.choices[0].message.content.strip().lower()
-        slug = re.sub(r"[^\w]", "_", raw)[:40].strip("_")
+        slug = _NONWORD.sub("_", raw)[:40].strip("_")
         return slug or "uncategorised"
     except Exception as e:
         logger.warning(f"Groq vision: {e}")
@@ -119,13 +250,15 @@ def groq_describe_for_folder(image_path: str) -> str:
 
 
 def _find_or_create_scene_person(user_id: str, slug: str) -> dict:
-    res = supabase.table("persons").select("*").eq("user_id", user_id).eq("folder_name", slug).execute()
+    res = get_supabase().table("persons").select("*").eq("user_id", user_id).eq("folder_name", slug).execute()
     if res.data:
         return res.data[0]
     pid  = str(uuid.uuid4())
     row  = {"id": pid, "user_id": user_id, "name": slug.replace("_", " ").title(),
             "folder_name": slug, "embedding": None}
-    supabase.table("persons").insert(row).execute()
+    _with_retry(lambda: get_supabase().table("persons")
+                .upsert(row, on_conflict="id", ignore_duplicates=True).execute())
+    _invalidate(user_id)
     folder_disk(user_id, slug)
     return row
 
@@ -134,100 +267,361 @@ def _find_or_create_scene_person(user_id: str, slug: str) -> dict:
 # FACE RECOGNITION
 # ══════════════════════════════════════════════════════════════════════════════
 
-def extract_embeddings(image_path: str) -> list:
+def _represent(img) -> list:
     try:
-        return DeepFace.represent(img_path=image_path, model_name=Config.DEEPFACE_MODEL,
-                                  detector_backend=Config.DEEPFACE_DETECTOR, enforce_detection=True)
+        return _deepface().represent(img_path=img, model_name=settings.DEEPFACE_MODEL,
+                                     detector_backend=settings.DEEPFACE_DETECTOR, enforce_detection=True)
     except Exception as e:
         logger.warning(f"DeepFace: {e}")
         return []
 
 
-def find_matching_person(user_id: str, embedding: list) -> dict | None:
-    persons = supabase.table("persons").select("*").eq("user_id", user_id).execute().data or []
-    best, score, thresh = None, -1.0, 1.0 - Config.DEEPFACE_DISTANCE_THRESHOLD
+def _embed_one(image_path: str) -> list:
+    import cv2
+    img = cv2.imread(image_path)
+    # cv2 cannot decode every format (e.g. GIF); let DeepFace load those itself
+    return _represent(img if img is not None else image_path)
+
+
+def extract_embeddings(image_paths: list[str]) -> list[list]:
+    """Faces found in each image, in input order.
+
+    DeepFace.represent() takes one image per call, so images are decoded and
+    run through the model on a small thread pool; TensorFlow releases the GIL.
+    """
+    if not image_paths:
+        return []
+    _load_face_models()
+    with ThreadPoolExecutor(max_workers=min(4, len(image_paths))) as pool:
+        return list(pool.map(_embed_one, image_paths))
+
+
+def _person_matrix(user_id: str) -> tuple[np.ndarray | None, list[dict]]:
+    with _person_matrices_lock:
+        hit = _person_matrices.get(user_id)
+    if hit is not None:
+        return hit
+
+    persons = get_supabase().table("persons").select("id,name,folder_name,embedding") \
+                .eq("user_id", user_id).execute().data or []
+    rows, vecs, legacy = [], [], False
     for p in persons:
         emb = p.get("embedding")
-        if not emb:
+        if not emb:  # scene / manually created folders carry no embedding
             continue
         if isinstance(emb, dict):
-            emb = emb.get("vector", [])
-        if not emb:
-            continue
-        s = cosine_similarity(embedding, emb)
-        if s > score:
-            score, best = s, p
-    return best if score >= thresh else None
+            vec = emb.get("vector")
+            if not vec:
+                continue
+            legacy |= not emb.get("normalized")
+        else:        # bare list from before embeddings were wrapped
+            vec, legacy = emb, True
+        rows.append(p)
+        vecs.append(vec)
+
+    matrix = None
+    if vecs:
+        matrix = np.asarray(vecs, dtype=np.float32)
+        if legacy:  # rows written before embeddings were stored unit-length
+            matrix = _normalize_rows(matrix)
+
+    entry = (matrix, rows)
+    with _person_matrices_lock:
+        _person_matrices[user_id] = entry
+    return entry
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def _invalidate_person_matrix(user_id: str):
+    with _person_matrices_lock:
+        _person_matrices.pop(user_id, None)
+
+
+def _invalidate(user_id: str):
+    """Drop every cached view of a user's persons after one is added/renamed/removed."""
+    invalidate_user_cache(user_id)
+    _invalidate_person_matrix(user_id)
+
+
+def match_faces_batch(user_id: str, embeddings: list[list]) -> list[dict | None]:
+    """Best matching person (or None) for each face, from one (F, D) x (D, N) product."""
+    matrix, rows = _person_matrix(user_id)
+    if matrix is None or not embeddings:
+        return [None] * len(embeddings)
+    q = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    sims   = q @ matrix.T
+    best   = sims.argmax(axis=1)
+    scores = sims[np.arange(len(best)), best]
+    thresh = 1.0 - settings.DEEPFACE_DISTANCE_THRESHOLD
+    return [rows[b] if s >= thresh else None for b, s in zip(best.tolist(), scores.tolist())]
 
 
 def create_face_person(user_id: str, embedding: list) -> dict:
     pid  = str(uuid.uuid4())
     fname = f"person_{pid[:8]}"
+    vec  = _normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
     row  = {"id": pid, "user_id": user_id, "name": "Unknown",
-            "folder_name": fname, "embedding": {"vector": embedding}}
-    supabase.table("persons").insert(row).execute()
+            "folder_name": fname, "embedding": {"vector": vec.tolist(), "normalized": True}}
+    _with_retry(lambda: get_supabase().table("persons")
+                .upsert(row, on_conflict="id", ignore_duplicates=True).execute())
+    _invalidate(user_id)
     folder_disk(user_id, fname)
     return row
 
 
+MIGRATION_PAGE = 500  # below PostgREST's default 1000-row response cap
+
+
+def normalize_stored_embeddings() -> int:
+    """One-shot migration: rewrite pre-existing face embeddings as unit vectors.
+
+    Returns the number of persons updated. Only rows not yet marked normalized
+    are read, a page at a time, so re-running picks up where it left off.
+    """
+    updated, users, last_id = 0, set(), None
+    while True:
+        q = get_supabase().table("persons").select("id,user_id,embedding") \
+              .not_.is_("embedding", "null").is_("embedding->normalized", "null")
+        if last_id is not None:
+            q = q.gt("id", last_id)
+        page = q.order("id").limit(MIGRATION_PAGE).execute().data or []
+        if not page:
+            break
+        last_id = page[-1]["id"]
+        for p in page:
+            emb = p["embedding"]
+            vec = emb.get("vector") if isinstance(emb, dict) else emb
+            if not vec:
+                continue
+            unit = _normalize_rows(np.asarray([vec], dtype=np.float32))[0]
+            get_supabase().table("persons").update(
+                {"embedding": {"vector": unit.tolist(), "normalized": True}}
+            ).eq("id", p["id"]).execute()
+            updated += 1
+            users.add(p["user_id"])
+    for uid in users:
+        _invalidate_person_matrix(uid)
+    return updated
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # UPLOAD PIPELINE
 # ══════════════════════════════════════════════════════════════════════════════
 
-def process_uploaded_image(user_id: str, image_path: str, filename: str) -> dict:
+_user_locks: dict[str, threading.Lock] = {}
+
+
+def _user_lock(user_id: str) -> threading.Lock:
+    return _user_locks.setdefault(user_id, threading.Lock())
+
+
+# Background face recognition: the request thread only writes the files and
+# the photos rows; embedding, matching, copies and links run on this pool.
+_upload_pool  = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload")
+
+# Per-upload status, polled via /upload/status. Kept in Redis when configured
+# so any gunicorn worker can answer; otherwise in this process only.
+UPLOAD_STATUS_TTL = 3600
+_statuses      = TTLCache(maxsize=10000, ttl=UPLOAD_STATUS_TTL)   # photo_id -> status entry
+_statuses_lock = threading.Lock()
+
+
+def _put_status(user_id: str, result: dict):
+    entry = {**result, "user_id": user_id}
+    r = get_redis()
+    if r is None:
+        with _statuses_lock:
+            _statuses[result["photo_id"]] = entry
+        return
+    try:
+        r.setex(f"upload:{result['photo_id']}", UPLOAD_STATUS_TTL, json.dumps(entry))
+    except Exception as e:
+        logger.warning(f"upload status {result['photo_id']}: {e}")
+
+
+def enqueue_uploads(user_id: str, uploads: list[tuple[str, str, str | None]]) -> list[dict]:
+    """Register uploads synchronously and queue their face processing.
+
+    Returned results carry ``status`` "processing" (or ``duplicate``); poll
+    upload_status() for the outcome.
+    """
+    results = [_register_photo(user_id, path, name, digest) for path, name, digest in uploads]
+    fresh   = [(r, path) for r, (path, _, _) in zip(results, uploads) if not r.get("duplicate")]
+    if not fresh:
+        return results
+
+    for r, _ in fresh:
+        r["status"] = "processing"
+        _put_status(user_id, r)
+    _upload_pool.submit(_process_registered, user_id, [(dict(r), path) for r, path in fresh])
+    return results
+
+
+def _process_registered(user_id: str, fresh: list[tuple[dict, str]]):
+    try:
+        faces_per_image = extract_embeddings([path for _, path in fresh])
+    except Exception as e:
+        logger.error(f"upload embeddings: {e}")
+        faces_per_image = None
+    for i, (result, path) in enumerate(fresh):
+        try:
+            if faces_per_image is None:
+                raise RuntimeError("face extraction failed")
+            result.update(_dispatch_faces(user_id, result["photo_id"], faces_per_image[i],
+                                          path, result["filename"]))
+            result["status"] = "done" if result["persons"] else "failed"
+        except Exception as e:
+            logger.error(f"upload {result['photo_id']}: {e}")
+            result["status"] = "failed"
+        if result["status"] == "failed":
+            _discard_photo(result["photo_id"])
+        _put_status(user_id, result)
+    invalidate_user_cache(user_id)
+
+
+def _discard_photo(photo_id: str):
+    """Drop the photos row of an upload that ended up in no folder."""
+    try:
+        get_supabase().table("photos").delete().eq("id", photo_id).execute()
+    except Exception as e:
+        logger.error(f"discard photo {photo_id}: {e}")
+
+
+def upload_status(user_id: str, photo_id: str) -> dict | None:
+    r = get_redis()
+    if r is None:
+        with _statuses_lock:
+            entry = _statuses.get(photo_id)
+        entry = dict(entry) if entry else None
+    else:
+        raw   = r.get(f"upload:{photo_id}")
+        entry = json.loads(raw) if raw else None
+    if entry is None or entry.pop("user_id") != user_id:
+        return None
+    return entry
+
+
+# PostgREST codes for "could not reach / connect to the database" (503/504).
+_TRANSIENT_PGRST_CODES = frozenset({"PGRST000", "PGRST001", "PGRST002", "PGRST003"})
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, TransportError):
+        return True
+    if isinstance(e, APIError):
+        # non-JSON gateway errors carry the bare HTTP status (an int) as their code
+        code = str(e.code or "")
+        return code in _TRANSIENT_PGRST_CODES or (code.isdigit() and code.startswith("5"))
+    return False
+
+
+def _with_retry(fn, attempts: int = 3):
+    """Run an idempotent Supabase write, retrying transport errors and 5xx with backoff."""
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not _is_transient(e):
+                raise
+            logger.warning(f"Supabase retry {attempt + 1}/{attempts - 1}: {e}")
+            time.sleep(2 ** attempt)
+
+
+def _register_photo(user_id: str, image_path: str, filename: str,
+                    content_hash: str | None) -> dict:
     result = {"filename": filename, "faces_detected": 0,
               "persons": [], "photo_id": None, "method": "deepface"}
 
+    # Same bytes already uploaded by this user and filed into a folder — skip
+    # detection entirely. Rows with no photo_persons link (processing failed or
+    # was lost) don't count, so the photo can be uploaded again.
+    if content_hash and get_supabase().table("photos").select("id, photo_persons!inner(id)") \
+            .eq("user_id", user_id).eq("content_hash", content_hash).limit(1).execute().data:
+        os.remove(image_path)
+        result["duplicate"] = True
+        return result
+
     photo_id = str(uuid.uuid4())
-    supabase.table("photos").insert({
+    get_supabase().table("photos").insert({
         "id": photo_id, "user_id": user_id,
         "filename": filename, "filepath": filename,
+        "content_hash": content_hash,
     }).execute()
     result["photo_id"] = photo_id
+    return result
+
 
-    faces = extract_embeddings(image_path)
-    result["faces_detected"] = len(faces)
+def _dispatch_faces(user_id: str, photo_id: str, faces: list,
+                    image_path: str, filename: str) -> dict:
+    """Route an image into person folders given its detected faces."""
+    out = {"faces_detected": len(faces), "persons": [], "method": "deepface"}
 
     if faces:
+        embs = [e for e in (face.get("embedding") for face in faces) if e]
+        # Serialise match-or-create per user so photos of one new face
+        # processed in parallel end up in a single person folder.
+        with _user_lock(user_id):
+            matches = match_faces_batch(user_id, embs)
+            persons = [m or create_face_person(user_id, e) for m, e in zip(matches, embs)]
         seen = set()
-        for face in faces:
-            emb = face.get("embedding", [])
-            if not emb:
-                continue
-            person = find_matching_person(user_id, emb) or create_face_person(user_id, emb)
+        for person in persons:
             if person["id"] in seen:
                 continue
             seen.add(person["id"])
             _copy_to_folder(user_id, person["folder_name"], image_path, filename)
-            _link(photo_id, person["id"])
-            result["persons"].append({"name": person["name"], "folder": person["folder_name"], "id": person["id"]})
+            out["persons"].append({"name": person["name"], "folder": person["folder_name"], "id": person["id"]})
     else:
-        result["method"] = "groq_vision"
+        out["method"] = "groq_vision"
         slug   = groq_describe_for_folder(image_path)
-        person = _find_or_create_scene_person(user_id, slug)
+        with _user_lock(user_id):
+            person = _find_or_create_scene_person(user_id, slug)
         _copy_to_folder(user_id, person["folder_name"], image_path, filename)
-        _link(photo_id, person["id"])
-        result["persons"].append({"name": person["name"], "folder": person["folder_name"], "id": person["id"]})
+        out["persons"].append({"name": person["name"], "folder": person["folder_name"], "id": person["id"]})
 
-    return result
+    _link(photo_id, [p["id"] for p in out["persons"]])
+    return out
 
 
-def _copy_to_folder(user_id: str, folder_name: str, src: str, filename: str):
-    dest = os.path.join(folder_disk(user_id, folder_name), filename)
-    if not os.path.exists(dest):
+def _place_file(src: str, dest: str):
+    """Hard-link ``src`` to ``dest`` so per-person copies share one inode; copy if linking fails."""
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        pass
+    except OSError:  # cross-device, or a filesystem without hard links
         shutil.copy2(src, dest)
 
 
-def _link(photo_id: str, person_id: str):
-    supabase.table("photo_persons").insert({"photo_id": photo_id, "person_id": person_id}).execute()
+def _copy_to_folder(user_id: str, folder_name: str, src: str, filename: str):
+    fdir = folder_disk(user_id, folder_name)
+    try:
+        _place_file(src, os.path.join(fdir, filename))
+    except FileNotFoundError:
+        # Folder removed behind our back (another worker, manual cleanup): recreate once.
+        _forget_dir(fdir)
+        _place_file(src, os.path.join(folder_disk(user_id, folder_name), filename))
+
+
+def _link(photo_id: str, person_ids: list[str]):
+    """Link a photo to all of its persons with one bulk insert."""
+    if not person_ids:
+        return
+    rows = [{"photo_id": photo_id, "person_id": pid} for pid in person_ids]
+    _with_retry(lambda: get_supabase().table("photo_persons")
+                .upsert(rows, on_conflict="photo_id,person_id", ignore_duplicates=True).execute())
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # PERSON / FOLDER MANAGEMENT
 # ══════════════════════════════════════════════════════════════════════════════
 
+@cached(key=lambda uid: f"persons:{uid}")
 def get_all_persons(user_id: str) -> list[dict]:
-    rows = supabase.table("persons").select("id,name,folder_name,created_at") \
+    rows = get_supabase().table("persons").select("id,name,folder_name,created_at") \
              .eq("user_id", user_id).order("created_at").execute().data or []
     for p in rows:
         imgs = list_images(folder_disk(user_id, p["folder_name"]))
@@ -237,7 +631,7 @@ def get_all_persons(user_id: str) -> list[dict]:
 
 
 def get_person_photos(person_id: str, user_id: str) -> list[dict]:
-    res = supabase.table("persons").select("folder_name,name") \
+    res = get_supabase().table("persons").select("folder_name,name") \
             .eq("id", person_id).eq("user_id", user_id).execute()
     if not res.data:
         return []
@@ -252,55 +646,54 @@ def get_person_photos(person_id: str, user_id: str) -> list[dict]:
 
 
 def rename_person(person_id: str, user_id: str, new_name: str) -> bool:
-    res = supabase.table("persons").update({"name": new_name}) \
+    res = get_supabase().table("persons").update({"name": new_name}) \
             .eq("id", person_id).eq("user_id", user_id).execute()
+    _invalidate(user_id)
     return bool(res.data)
 
 
 def create_folder(user_id: str, display_name: str) -> dict:
     slug = slugify(display_name)
-    if supabase.table("persons").select("id").eq("user_id", user_id).eq("folder_name", slug).execute().data:
+    if get_supabase().table("persons").select("id").eq("user_id", user_id).eq("folder_name", slug).execute().data:
         slug = f"{slug}_{uuid.uuid4().hex[:4]}"
     pid = str(uuid.uuid4())
     row = {"id": pid, "user_id": user_id, "name": display_name, "folder_name": slug, "embedding": None}
-    supabase.table("persons").insert(row).execute()
+    get_supabase().table("persons").insert(row).execute()
+    _invalidate(user_id)
     folder_disk(user_id, slug)
     return row
 
 
 def delete_folder(person_id: str, user_id: str) -> bool:
-    res = supabase.table("persons").select("folder_name") \
+    res = get_supabase().table("persons").select("folder_name") \
             .eq("id", person_id).eq("user_id", user_id).execute()
     if not res.data:
         return False
     fname = res.data[0]["folder_name"]
 
-    # Find all photo_ids linked to this person, then delete photos + photo_persons
-    pp_rows = supabase.table("photo_persons").select("photo_id") \
+    # Delete photo_persons links first (FK constraint); the deleted rows
+    # come back in the response, so no separate select is needed
+    pp_rows = get_supabase().table("photo_persons").delete() \
                 .eq("person_id", person_id).execute().data or []
-    photo_ids = [r["photo_id"] for r in pp_rows]
-
-    # Delete photo_persons links first (FK constraint)
-    supabase.table("photo_persons").delete().eq("person_id", person_id).execute()
+    photo_ids = list({r["photo_id"] for r in pp_rows})
 
     # Delete photos rows that now have no remaining person links
-    for pid in photo_ids:
-        remaining = supabase.table("photo_persons").select("id") \
-                      .eq("photo_id", pid).execute().data or []
-        if not remaining:
-            supabase.table("photos").delete().eq("id", pid).execute()
+    _delete_orphan_photos(photo_ids)
 
     # Delete the person record
-    supabase.table("persons").delete().eq("id", person_id).execute()
+    get_supabase().table("persons").delete().eq("id", person_id).execute()
+    _invalidate(user_id)
 
     # Remove disk folder
-    shutil.rmtree(os.path.join(user_root(user_id), fname), ignore_errors=True)
+    fdir = os.path.join(user_root(user_id), fname)
+    shutil.rmtree(fdir, ignore_errors=True)
+    _forget_dir(fdir)
     logger.info(f"Deleted folder {fname} and {len(photo_ids)} photo record(s)")
     return True
 
 
 def delete_photo_from_folder(person_id: str, user_id: str, filename: str) -> bool:
-    res = supabase.table("persons").select("folder_name") \
+    res = get_supabase().table("persons").select("folder_name") \
             .eq("id", person_id).eq("user_id", user_id).execute()
     if not res.data:
         return False
@@ -313,24 +706,40 @@ def delete_photo_from_folder(person_id: str, user_id: str, filename: str) -> boo
         return False
 
     # Remove photo_persons link for this person
-    photos_rows = supabase.table("photos").select("id") \
+    photos_rows = get_supabase().table("photos").select("id") \
                     .eq("user_id", user_id).eq("filename", filename).execute().data or []
-    for ph in photos_rows:
-        supabase.table("photo_persons").delete() \
-            .eq("photo_id", ph["id"]).eq("person_id", person_id).execute()
+    photo_ids = [ph["id"] for ph in photos_rows]
+    if photo_ids:
+        get_supabase().table("photo_persons").delete() \
+            .in_("photo_id", photo_ids).eq("person_id", person_id).execute()
         # If no more person links, delete the photos row too
-        remaining = supabase.table("photo_persons").select("id") \
-                      .eq("photo_id", ph["id"]).execute().data or []
-        if not remaining:
-            supabase.table("photos").delete().eq("id", ph["id"]).execute()
+        _delete_orphan_photos(photo_ids)
 
+    invalidate_user_cache(user_id)
     return True
 
 
+IN_BATCH = 100  # ids per IN (...) filter, keeps PostgREST URLs well under size limits
+
+
+def _delete_orphan_photos(photo_ids: list[str]) -> int:
+    """Delete the photos rows among ``photo_ids`` that have no photo_persons link left."""
+    orphans = 0
+    for i in range(0, len(photo_ids), IN_BATCH):
+        chunk  = photo_ids[i:i + IN_BATCH]
+        linked = get_supabase().table("photo_persons").select("photo_id") \
+                   .in_("photo_id", chunk).execute().data or []
+        dead   = list(set(chunk) - {r["photo_id"] for r in linked})
+        if dead:
+            get_supabase().table("photos").delete().in_("id", dead).execute()
+            orphans += len(dead)
+    return orphans
+
+
 def move_photo_to_folder(user_id: str, src_person_id: str, dest_person_id: str,
                          filename: str, keep_in_source: bool = False) -> bool:
-    src_res  = supabase.table("persons").select("folder_name").eq("id", src_person_id).eq("user_id", user_id).execute()
-    dest_res = supabase.table("persons").select("folder_name").eq("id", dest_person_id).eq("user_id", user_id).execute()
+    src_res  = get_supabase().table("persons").select("folder_name").eq("id", src_person_id).eq("user_id", user_id).execute()
+    dest_res = get_supabase().table("persons").select("folder_name").eq("id", dest_person_id).eq("user_id", user_id).execute()
     if not src_res.data or not dest_res.data:
         return False
 
@@ -342,17 +751,26 @@ def move_photo_to_folder(user_id: str, src_person_id: str, dest_person_id: str,
     if not os.path.isfile(src_file):
         return False
 
-    shutil.copy2(src_file, dst_file)
-    if not keep_in_source:
+    if keep_in_source:
+        _place_file(src_file, dst_file)
+    elif os.path.exists(dst_file):
+        # Group photos are hard links of one file; rename() between two links
+        # to the same inode is a no-op, so just drop the source link.
         os.remove(src_file)
+    else:
+        try:
+            os.replace(src_file, dst_file)
+        except OSError:  # cross-device
+            shutil.move(src_file, dst_file)
 
-    photos = supabase.table("photos").select("id").eq("user_id", user_id).eq("filename", filename).execute().data or []
+    photos = get_supabase().table("photos").select("id").eq("user_id", user_id).eq("filename", filename).execute().data or []
     if photos:
         pid = photos[0]["id"]
-        if not supabase.table("photo_persons").select("id").eq("photo_id", pid).eq("person_id", dest_person_id).execute().data:
-            supabase.table("photo_persons").insert({"photo_id": pid, "person_id": dest_person_id}).execute()
+        if not get_supabase().table("photo_persons").select("id").eq("photo_id", pid).eq("person_id", dest_person_id).execute().data:
+            get_supabase().table("photo_persons").insert({"photo_id": pid, "person_id": dest_person_id}).execute()
         if not keep_in_source:
-            supabase.table("photo_persons").delete().eq("photo_id", pid).eq("person_id", src_person_id).execute()
+            get_supabase().table("photo_persons").delete().eq("photo_id", pid).eq("person_id", src_person_id).execute()
+    invalidate_user_cache(user_id)
     return True
 
 
@@ -360,15 +778,35 @@ def move_photo_to_folder(user_id: str, src_person_id: str, dest_person_id: str,
 # DASHBOARD STATS
 # ══════════════════════════════════════════════════════════════════════════════
 
+# PostgREST "function not in schema cache" / Postgres undefined_function.
+_MISSING_FUNCTION_CODES = frozenset({"PGRST202", "42883"})
+
+
+@cached(key=lambda uid: f"stats:{uid}")
 def get_dashboard_stats(user_id: str) -> dict:
+    # One round trip via the dashboard_stats() SQL function (see README); scan
+    # the disk only if it has not been installed.
+    try:
+        stats = get_supabase().rpc("dashboard_stats", {"p_user_id": user_id}).execute().data
+    except APIError as e:
+        if e.code not in _MISSING_FUNCTION_CODES:
+            raise
+        logger.warning(f"dashboard_stats() not installed, scanning disk: {e.message}")
+        return _dashboard_stats_from_disk(user_id)
+    for ph in stats["recent_photos"]:
+        ph["url"] = make_url(user_id, ph["folder_name"], ph["filename"])
+    return stats
+
+
+def _dashboard_stats_from_disk(user_id: str) -> dict:
     # Count persons live from DB (accurate after deletes)
-    total_persons    = supabase.table("persons").select("id", count="exact") \
+    total_persons    = get_supabase().table("persons").select("id", count="exact") \
                          .eq("user_id", user_id).execute().count or 0
-    total_deliveries = supabase.table("delivery_history").select("id", count="exact") \
+    total_deliveries = get_supabase().table("delivery_history").select("id", count="exact") \
                          .eq("user_id", user_id).execute().count or 0
 
     # Scan disk for accurate photo count + recent images (DB photos table may have orphans)
-    persons = supabase.table("persons").select("id,folder_name,name") \
+    persons = get_supabase().table("persons").select("id,folder_name,name") \
                 .eq("user_id", user_id).execute().data or []
 
     all_imgs = []
@@ -376,12 +814,7 @@ def get_dashboard_stats(user_id: str) -> dict:
 
     for p in persons:
         fdir = folder_disk(user_id, p["folder_name"])
-        for fname in list_images(fdir):
-            fpath = os.path.join(fdir, fname)
-            try:
-                mtime = os.path.getmtime(fpath)
-            except OSError:
-                mtime = 0
+        for fname, mtime in _scan_images(fdir):
             all_imgs.append({
                 "filename":    fname,
                 "url":         make_url(user_id, p["folder_name"], fname),
@@ -391,8 +824,6 @@ def get_dashboard_stats(user_id: str) -> dict:
             })
             seen_filenames.add(fname)
 
-    all_imgs.sort(key=lambda x: x["mtime"], reverse=True)
-
     # total_photos = unique files on disk (not DB count which can be stale)
     total_photos = len(seen_filenames)
 
@@ -400,7 +831,7 @@ def get_dashboard_stats(user_id: str) -> dict:
         "total_photos":     total_photos,
         "total_persons":    total_persons,
         "total_deliveries": total_deliveries,
-        "recent_photos":    all_imgs[:8],
+        "recent_photos":    heapq.nlargest(8, all_imgs, key=lambda x: x["mtime"]),
     }
 
 
@@ -434,7 +865,7 @@ def chat_with_assistant(user_id: str, user_message: str, history: list) -> dict:
     messages.append({"role": "user", "content": user_message})
 
     try:
-        resp  = groq_client.chat.completions.create(model=Config.GROQ_MODEL, messages=messages,
+        resp  = get_groq().chat.completions.create(model=settings.GROQ_MODEL, messages=messages,
                                                      temperature=0.4, max_tokens=900)
         reply = resp.choices[0].message.content.strip()
     except Exception as e:
@@ -470,7 +901,7 @@ def chat_with_assistant(user_id: str, user_message: str, history: list) -> dict:
                     recip  = action_data.get("recipient", "")
                     if person and recip:
                         r     = send_photos_by_email(user_id, person["id"], recip)
-                        plain = (f"✅ Sent **{r['photos_sent']}** photo(s) to **{recip}**!"
+                        plain = (f"📤 Sending **{r['photos_sent']}** photo(s) to **{recip}**…"
                                  if r["success"] else f"❌ Failed: {r.get('error')}")
                     else:
                         plain = "Provide a valid person name and recipient email."
@@ -492,7 +923,7 @@ def chat_with_assistant(user_id: str, user_message: str, history: list) -> dict:
 def _find_person_by_name(user_id: str, name: str) -> dict | None:
     if not name:
         return None
-    data = supabase.table("persons").select("*").eq("user_id", user_id) \
+    data = get_supabase().table("persons").select("*").eq("user_id", user_id) \
              .ilike("name", f"%{name}%").execute().data or []
     return data[0] if data else None
 
@@ -501,9 +932,13 @@ def _find_person_by_name(user_id: str, name: str) -> dict | None:
 # EMAIL
 # ══════════════════════════════════════════════════════════════════════════════
 
+MAX_ATTACHMENTS = 10
+ATTACH_WORKERS  = 8
+
+
 def send_photos_by_email(user_id: str, person_id: str,
                          recipient_email: str, custom_message: str = "") -> dict:
-    res = supabase.table("persons").select("name,folder_name").eq("id", person_id).execute()
+    res = get_supabase().table("persons").select("name,folder_name").eq("id", person_id).execute()
     if not res.data:
         return {"success": False, "error": "Person not found"}
     person = res.data[0]
@@ -513,44 +948,46 @@ def send_photos_by_email(user_id: str, person_id: str,
         return {"success": False, "error": "No photos found"}
 
     msg = MIMEMultipart()
-    msg["From"], msg["To"] = Config.GMAIL_EMAIL, recipient_email
+    msg["From"], msg["To"] = settings.GMAIL_EMAIL, recipient_email
     msg["Subject"] = f"Photos of {person['name']} – Drishyamitra"
     msg.attach(MIMEText(custom_message or
         f"Hi,\n\nAttached: {len(files)} photo(s) of {person['name']}.\n\nDrishyamitra", "plain"))
 
-    attached = 0
-    for fp in files[:10]:
-        try:
-            with open(fp, "rb") as f:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header("Content-Disposition", f"attachment; filename={os.path.basename(fp)}")
-            msg.attach(part); attached += 1
-        except Exception as e:
-            logger.warning(f"attach: {e}")
+    with ThreadPoolExecutor(max_workers=min(ATTACH_WORKERS, len(files))) as pool:
+        parts = [p for p in pool.map(_load_attachment, files[:MAX_ATTACHMENTS]) if p]
+    for part in parts:
+        msg.attach(part)
+    attached = len(parts)
 
+    # SMTP runs on the mailer pool; the delivery row is written once it finishes.
+    send_message_task(recipient_email, msg, lambda error: _log_delivery(
+        user_id, person_id, recipient_email, attached,
+        "failed" if error else "sent", error))
+    return {"success": True, "queued": True, "photos_sent": attached}
+
+
+def _load_attachment(path: str) -> MIMEBase | None:
     try:
-        with smtplib.SMTP(Config.GMAIL_SMTP_HOST, Config.GMAIL_SMTP_PORT) as s:
-            s.ehlo(); s.starttls()
-            s.login(Config.GMAIL_EMAIL, Config.GMAIL_APP_PASSWORD)
-            s.sendmail(Config.GMAIL_EMAIL, recipient_email, msg.as_string())
+        with open(path, "rb") as f:
+            part = MIMEBase("application", "octet-stream")
+            part.set_payload(f.read())
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename={os.path.basename(path)}")
+        return part
     except Exception as e:
-        _log_delivery(user_id, person_id, recipient_email, attached, "failed", str(e))
-        return {"success": False, "error": str(e)}
-
-    _log_delivery(user_id, person_id, recipient_email, attached, "sent", "")
-    return {"success": True, "photos_sent": attached}
+        logger.warning(f"attach: {e}")
+        return None
 
 
 def _log_delivery(user_id, person_id, recipient, count, status, message):
-    supabase.table("delivery_history").insert({
+    get_supabase().table("delivery_history").insert({
         "user_id": user_id, "person_id": person_id,
         "recipient_email": recipient, "photo_count": count,
         "status": status, "message": message,
     }).execute()
+    invalidate_user_cache(user_id)  # total_deliveries
 
 
 def get_delivery_history(user_id: str) -> list:
-    return supabase.table("delivery_history").select("*, persons(name,folder_name)") \
+    return get_supabase().table("delivery_history").select("*, persons(name,folder_name)") \
              .eq("user_id", user_id).order("delivered_at", desc=True).execute().data or []
\ No newline at end of file
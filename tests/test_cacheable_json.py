@@ -0,0 +1,38 @@
+import os
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+import pytest
+from app import create_app
+from routes import cacheable_json
+
+PAYLOAD = {"persons": [{"name": f"person_{i}", "photo_count": i} for i in range(50)]}
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+
+    @app.route("/_test/cacheable")
+    def cacheable():
+        return cacheable_json(PAYLOAD)
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "identity"])
+def test_revalidation_returns_304(client, encoding):
+    first = client.get("/_test/cacheable", headers={"Accept-Encoding": encoding})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = client.get("/_test/cacheable",
+                       headers={"Accept-Encoding": encoding, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+
+
+def test_changed_payload_returns_200(client):
+    resp = client.get("/_test/cacheable", headers={"Accept-Encoding": "gzip",
+                                                  "If-None-Match": '"stale:gzip"'})
+    assert resp.status_code == 200
@@ -0,0 +1,4 @@
+from app import create_app
+
+# gunicorn -w $(nproc) -k gthread --threads 8 -b 0.0.0.0:5000 wsgi:app
+app = create_app()